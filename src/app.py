@@ -1,13 +1,16 @@
 import streamlit as st
 from pathlib import Path
+import atexit
 import tempfile
 import os
-import json
+import orjson
 import uuid
 import shutil
 from datetime import datetime
+import torch
+from sentence_transformers import SentenceTransformer
 from chunking import process_pdf
-from embed_and_index import embed_chunks
+from embed_and_index import embed_chunks, DEFAULT_EMBEDDING_MODEL
 from retriever import Retriever
 from generator import Generator
 
@@ -18,6 +21,15 @@ st.set_page_config(page_title="Multilingual RAG Chatbot", layout="wide")
 st.title("📄 Multilingual RAG Chatbot")
 st.markdown("Upload multiple PDFs and chat with the AI about their content.")
 
+
+@st.cache_resource
+def get_embedder():
+    """Load the embedding model once and share it across uploads/sessions."""
+    return SentenceTransformer(
+        DEFAULT_EMBEDDING_MODEL,
+        device="cuda" if torch.cuda.is_available() else "cpu"
+    )
+
 # ----------------------------
 # Cleanup Management
 # ----------------------------
@@ -76,20 +88,29 @@ def cleanup_current_session_data():
 # Chat History Management
 # ----------------------------
 def load_chat_history():
-    """Load chat history from file"""
+    """Load chat history as {session_id: {pdf_name: [chat, ...]}}"""
     try:
         if os.path.exists("chat_history.json"):
-            with open("chat_history.json", "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open("chat_history.json", "rb") as f:
+                data = orjson.loads(f.read())
+            if isinstance(data, list):
+                # Migrate the legacy flat list into the nested layout
+                nested = {}
+                for chat in data:
+                    sid = chat.get("session_id", "unknown")
+                    pdf = chat.get("pdf_name", "unknown")
+                    nested.setdefault(sid, {}).setdefault(pdf, []).append(chat)
+                return nested
+            return data
     except Exception as e:
         pass  # Silent loading
-    return []
+    return {}
 
 def save_chat_history(chat_history):
     """Save chat history to file"""
     try:
-        with open("chat_history.json", "w", encoding="utf-8") as f:
-            json.dump(chat_history, f, indent=2, ensure_ascii=False)
+        with open("chat_history.json", "wb") as f:
+            f.write(orjson.dumps(chat_history, option=orjson.OPT_INDENT_2))
     except Exception as e:
         pass  # Silent save
 
@@ -114,8 +135,11 @@ if "active_pdf" not in st.session_state:
 if "session_cleanup_done" not in st.session_state:
     st.session_state["session_cleanup_done"] = False
 
-if "temp_files" not in st.session_state:
-    st.session_state["temp_files"] = []  # Track temporary files for cleanup
+if "tmp_dir" not in st.session_state:
+    # One session-scoped directory for uploaded PDFs; removed in one go at
+    # process exit instead of tracking and unlinking files on every rerun
+    st.session_state["tmp_dir"] = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, st.session_state["tmp_dir"], ignore_errors=True)
 
 # ----------------------------
 # Cleanup previous session data on startup
@@ -181,13 +205,10 @@ if uploaded_files and process_button:
             
         st.info(f"🔹 Processing {uploaded_file.name}...")
         
-        # Create temporary file but don't delete it yet
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            pdf_path = tmp_file.name
-        
-        # Store temp file path for later cleanup
-        st.session_state.temp_files.append(pdf_path)
+        # Write the upload into the session temp dir
+        pdf_path = os.path.join(st.session_state.tmp_dir, uploaded_file.name)
+        with open(pdf_path, "wb") as f:
+            f.write(uploaded_file.read())
 
         # Chunking
         try:
@@ -196,26 +217,14 @@ if uploaded_files and process_button:
             st.success(f"✅ {uploaded_file.name} processed into {len(chunk_files)} chunks")
         except Exception as e:
             st.error(f"❌ Error processing {uploaded_file.name}: {e}")
-            # Clean up temp file on error
-            try:
-                os.unlink(pdf_path)
-                st.session_state.temp_files.remove(pdf_path)
-            except:
-                pass
             continue
 
         # Embedding + FAISS
         try:
-            total_chunks, faiss_index_path, metadata_path = embed_chunks(chunk_dir)
+            total_chunks, faiss_index_path, metadata_path, embeddings_path = embed_chunks(chunk_dir, model=get_embedder())
             st.success(f"✅ Embedded {total_chunks} chunks from {uploaded_file.name}")
         except Exception as e:
             st.error(f"❌ Error during embedding {uploaded_file.name}: {e}")
-            # Clean up temp file on error
-            try:
-                os.unlink(pdf_path)
-                st.session_state.temp_files.remove(pdf_path)
-            except:
-                pass
             continue
 
         # Initialize Retriever
@@ -226,16 +235,11 @@ if uploaded_files and process_button:
                 metadata_path=metadata_path,
                 semantic_weight=0.6,
                 keyword_weight=0.4,
-                top_k=10
+                top_k=10,
+                use_mmap=True
             )
         except Exception as e:
             st.error(f"❌ Error initializing Retriever for {uploaded_file.name}: {e}")
-            # Clean up temp file on error
-            try:
-                os.unlink(pdf_path)
-                st.session_state.temp_files.remove(pdf_path)
-            except:
-                pass
             continue
 
         # Initialize Generator
@@ -257,37 +261,11 @@ if uploaded_files and process_button:
                 st.session_state.active_pdf = uploaded_file.name
                 
             st.success(f"✅ {uploaded_file.name} ready for chatting!")
-            
-            # Now we can safely delete the temp file after successful processing
-            try:
-                os.unlink(pdf_path)
-                st.session_state.temp_files.remove(pdf_path)
-            except:
-                pass
-            
+
         except Exception as e:
             st.error(f"❌ Error initializing Generator for {uploaded_file.name}: {e}")
-            # Clean up temp file on error
-            try:
-                os.unlink(pdf_path)
-                st.session_state.temp_files.remove(pdf_path)
-            except:
-                pass
             continue
 
-# ----------------------------
-# Clean up any remaining temp files
-# ----------------------------
-def cleanup_temp_files():
-    """Clean up any remaining temporary files"""
-    for temp_file in st.session_state.temp_files[:]:
-        try:
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
-            st.session_state.temp_files.remove(temp_file)
-        except Exception as e:
-            pass  # Silent cleanup
-
 # ----------------------------
 # Main Content Area with Two Columns
 # ----------------------------
@@ -309,12 +287,11 @@ if st.session_state.processed_pdfs and st.session_state.active_pdf:
         retriever = active_pdf_data["retriever"]
         generator = active_pdf_data["generator"]
 
-        # Display current session chats for active PDF
-        current_session_chats = [
-            chat for chat in st.session_state.chat_history 
-            if chat.get("session_id") == st.session_state.session_id 
-            and chat.get("pdf_name") == st.session_state.active_pdf
-        ]
+        # Display current session chats for active PDF — O(1) lookup in the
+        # nested dict instead of scanning every stored message per rerun
+        current_session_chats = st.session_state.chat_history.get(
+            st.session_state.session_id, {}
+        ).get(st.session_state.active_pdf, [])
         
         if current_session_chats:
             for i, chat in enumerate(current_session_chats):
@@ -325,7 +302,7 @@ if st.session_state.processed_pdfs and st.session_state.active_pdf:
                 # expander_label = f"🔍 Show context for this answer"
                 # with st.expander(expander_label):
                 #     for j, c in enumerate(chat.get("context", [])):
-                #         st.markdown(f"- **[{c['language']}]** {c['text'][:300]}... (Source: {c['source_file']})")
+                #         st.markdown(f"- **[{c['language']}]** {c['preview'][:300]}... (Source: {c['source_file']})")
                 #st.markdown("---")
         else:
             st.info("💡 Start a conversation by asking a question below!")
@@ -354,20 +331,30 @@ if st.session_state.processed_pdfs and st.session_state.active_pdf:
                 retriever_results = retriever.hybrid_search(query)
                 
                 # Generate answer - FIXED: Using the correct generator for active PDF
-                answer = generator.generate_answer(query, retriever_results)
+                # Stream tokens into the UI as they arrive; write_stream
+                # returns the accumulated answer for the chat entry below.
+                answer = st.write_stream(generator.stream_answer(query, retriever_results))
 
                 # Create chat entry with metadata
                 chat_entry = {
                     "user": query,
                     "bot": answer,
-                    "context": retriever_results[:5],
+                    # Keep only the preview in session state / chat_history.json
+                    # — the full "text" field would rewrite five whole chunks
+                    # to disk on every message.
+                    "context": [
+                        {k: v for k, v in r.items() if k != "text"}
+                        for r in retriever_results[:5]
+                    ],
                     "timestamp": datetime.now().isoformat(),
                     "session_id": st.session_state.session_id,
                     "pdf_name": st.session_state.active_pdf
                 }
 
                 # Append to chat history
-                st.session_state.chat_history.append(chat_entry)
+                st.session_state.chat_history.setdefault(
+                    st.session_state.session_id, {}
+                ).setdefault(st.session_state.active_pdf, []).append(chat_entry)
                 
                 # Save to persistent storage
                 save_chat_history(st.session_state.chat_history)
@@ -382,32 +369,20 @@ if st.session_state.processed_pdfs and st.session_state.active_pdf:
         st.markdown("---")
         st.subheader("📚 Previous Sessions")
         
-        # Show previous sessions chat history
-        previous_sessions_chats = [
-            chat for chat in st.session_state.chat_history 
-            if chat.get("session_id") != st.session_state.session_id
-        ]
-        
-        if previous_sessions_chats:
-            # Group by session and PDF
-            sessions_data = {}
-            for chat in previous_sessions_chats:
-                session_id = chat.get("session_id", "unknown")
-                pdf_name = chat.get("pdf_name", "unknown")
-                
-                if session_id not in sessions_data:
-                    sessions_data[session_id] = {}
-                if pdf_name not in sessions_data[session_id]:
-                    sessions_data[session_id][pdf_name] = []
-                    
-                sessions_data[session_id][pdf_name].append(chat)
-            
+        # Show previous sessions chat history (already grouped by
+        # session/PDF in the nested dict)
+        sessions_data = {
+            sid: pdfs for sid, pdfs in st.session_state.chat_history.items()
+            if sid != st.session_state.session_id and pdfs
+        }
+
+        if sessions_data:
             # Display previous sessions in reverse chronological order
-            sorted_sessions = sorted(sessions_data.items(), key=lambda x: 
-                max([chat.get('timestamp', '') for chat in sum(x[1].values(), [])]), 
+            sorted_sessions = sorted(sessions_data.items(), key=lambda x:
+                max([chat.get('timestamp', '') for chats in x[1].values() for chat in chats]),
                 reverse=True
             )
-            
+
             for session_id, pdfs_data in sorted_sessions[:5]:  # Show only last 5 sessions
                 session_display_id = session_id[:6] + "..."
                 
@@ -439,35 +414,22 @@ else:
     # When no PDF is processed, show full width previous sessions
     st.info("👈 Please upload and process PDF files to start chatting.")
     
-    # Show previous sessions chat history
-    previous_sessions_chats = [
-        chat for chat in st.session_state.chat_history 
-        if chat.get("session_id") != st.session_state.session_id
-    ]
-    
-    if previous_sessions_chats:
+    # Show previous sessions chat history (already grouped by session/PDF)
+    sessions_data = {
+        sid: pdfs for sid, pdfs in st.session_state.chat_history.items()
+        if sid != st.session_state.session_id and pdfs
+    }
+
+    if sessions_data:
         st.markdown("---")
         st.subheader("📚 Previous Sessions Chat History")
-        
-        # Group by session and PDF
-        sessions_data = {}
-        for chat in previous_sessions_chats:
-            session_id = chat.get("session_id", "unknown")
-            pdf_name = chat.get("pdf_name", "unknown")
-            
-            if session_id not in sessions_data:
-                sessions_data[session_id] = {}
-            if pdf_name not in sessions_data[session_id]:
-                sessions_data[session_id][pdf_name] = []
-                
-            sessions_data[session_id][pdf_name].append(chat)
-        
+
         # Display previous sessions in reverse chronological order
-        sorted_sessions = sorted(sessions_data.items(), key=lambda x: 
-            max([chat.get('timestamp', '') for chat in sum(x[1].values(), [])]), 
+        sorted_sessions = sorted(sessions_data.items(), key=lambda x:
+            max([chat.get('timestamp', '') for chats in x[1].values() for chat in chats]),
             reverse=True
         )
-        
+
         for session_id, pdfs_data in sorted_sessions[:8]:  # Show more when no active PDF
             session_display_id = session_id[:6] + "..."
             
@@ -499,11 +461,6 @@ def cleanup_before_exit():
     """Clean up session data before exit"""
     if not st.session_state.get("session_cleanup_done", False):
         cleanup_current_session_data()
-        cleanup_temp_files()
-
-# Register cleanup function
-import atexit
-atexit.register(cleanup_before_exit)
 
-# Also cleanup temp files on rerun
-cleanup_temp_files()
\ No newline at end of file
+# Register cleanup function (the session tmp_dir has its own atexit hook)
+atexit.register(cleanup_before_exit)
\ No newline at end of file
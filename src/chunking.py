@@ -3,21 +3,55 @@ import pytesseract
 from PIL import Image
 import re
 import os
-import json
 import uuid
+import orjson
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from langdetect import detect, DetectorFactory
 
+try:
+    import fasttext  # optional: C++ lid.176 model, much faster than langdetect
+except ImportError:
+    fasttext = None
+
 # ---------------- CONFIG ----------------
 DetectorFactory.seed = 42
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
+FASTTEXT_LID_PATH = os.environ.get("FASTTEXT_LID_PATH", "lid.176.ftz")
+_LID = None  # lazily loaded fastText language-ID model
+
+# Unicode block -> Tesseract model, used to avoid loading all six LSTM
+# models on every OCR call.
+_SCRIPT_RANGES = (
+    ((0x0980, 0x09FF), "ben"),
+    ((0x0900, 0x097F), "hin"),
+    ((0x0600, 0x06FF), "urd"),
+    ((0x4E00, 0x9FFF), "chi_sim+chi_tra"),
+)
+
 MAX_TOKENS = 320    # target tokens per chunk (~words)
 MIN_TOKENS = 50    # minimum tokens per chunk
 
+OCR_ALL_LANGS = "eng+ben+hin+urd+chi_sim+chi_tra"
+# Script codepoints needed in the extracted text layer before we trust
+# it to pick a single OCR language.
+_MIN_SCRIPT_HITS = 10
+
+# Precompiled patterns — these run on every page, so skip re's per-call
+# pattern-cache lookup. Zero-width chars are deleted (not spaced):
+# ZWSP/ZWNJ appear inside Bengali/Devanagari words, where replacing
+# them with a space would split the word in two.
+_ZW_RE = re.compile(r'[\u200b\u200c]')
+_WS_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'\w+')
+_CRLF_RE = re.compile(r'\r\n')
+_PARA_RE = re.compile(r'\n+')
+_SENT_RE = re.compile(r'(?<=[।.!?])\s+')
+
 
 # ---------------- HELPERS ----------------
-def ocr_image_to_text(image_path, langs="eng+ben+hin+urd+chi_sim+chi_tra"):
+def ocr_image_to_text(image_path, langs=OCR_ALL_LANGS):
     """Run OCR on an image and return extracted text."""
     img = Image.open(image_path)
     text = pytesseract.image_to_string(img, lang=langs)
@@ -26,14 +60,12 @@ def ocr_image_to_text(image_path, langs="eng+ben+hin+urd+chi_sim+chi_tra"):
 
 def clean_text(text: str) -> str:
     """Remove unwanted spaces, zero-width chars, etc."""
-    text = re.sub(r'\s+', ' ', text)
-    text = text.replace('\u200c', '').replace('\u200b', '')
-    return text.strip()
+    return _WS_RE.sub(' ', _ZW_RE.sub('', text)).strip()
 
 
 def count_tokens(text: str) -> int:
     """Rough token count (approx by word count)."""
-    return len(re.findall(r'\w+', text))
+    return len(_WORD_RE.findall(text))
 
 
 def detect_language_hint(text: str) -> str:
@@ -44,77 +76,194 @@ def detect_language_hint(text: str) -> str:
         return "unknown"
 
 
+def pick_langs(probe_text: str) -> str:
+    """Pick Tesseract language(s) from the script profile of probe text.
+
+    Each extra language makes Tesseract load another LSTM model and slows
+    recognition, so count codepoints per script block and request only
+    English plus the dominant script. A true scan has little or no text
+    layer to probe — guessing "eng" there would OCR non-Latin pages into
+    garbage, so with too few script hits fall back to the full set.
+    """
+    counts = {}
+    for ch in probe_text:
+        cp = ord(ch)
+        for (lo, hi), lang in _SCRIPT_RANGES:
+            if lo <= cp <= hi:
+                counts[lang] = counts.get(lang, 0) + 1
+                break
+    if sum(counts.values()) < _MIN_SCRIPT_HITS:
+        return OCR_ALL_LANGS
+    return "eng+" + max(counts, key=counts.get)
+
+
+def detect_languages_batch(texts):
+    """Detect the language of many chunks in one go.
+
+    Uses the fastText lid.176 model when available (predicts the whole
+    batch at C speed); otherwise falls back to one langdetect call on the
+    combined text and assigns that label to every chunk, so detection runs
+    once per page instead of once per chunk.
+    """
+    global _LID
+    if not texts:
+        return []
+
+    if fasttext is not None and os.path.exists(FASTTEXT_LID_PATH):
+        if _LID is None:
+            _LID = fasttext.load_model(FASTTEXT_LID_PATH)
+        labels, _ = _LID.predict([t.replace("\n", " ") for t in texts], k=1)
+        return [lbl[0].replace("__label__", "") if lbl else "unknown" for lbl in labels]
+
+    page_lang = detect_language_hint(" ".join(texts))
+    return [page_lang] * len(texts)
+
+
 # ---------------- CHUNKING ----------------
 def multilingual_chunk(text, max_tokens=MAX_TOKENS, min_tokens=MIN_TOKENS):
     """Split multilingual text into balanced chunks."""
-    text = re.sub(r'\r\n', '\n', text)
-    paragraphs = [p.strip() for p in re.split(r'\n{1,}', text) if p.strip()]
+    text = _CRLF_RE.sub('\n', text)
+    paragraphs = [p.strip() for p in _PARA_RE.split(text) if p.strip()]
     chunks = []
-    current_chunk = ""
+    # Keep a running token count + list buffer so we never re-scan
+    # already-accumulated text (count_tokens is O(len) per call).
+    buf = []
+    buf_tokens = 0
 
     for para in paragraphs:
         para_tokens = count_tokens(para)
-        current_tokens = count_tokens(current_chunk)
 
-        if current_tokens + para_tokens <= max_tokens:
-            current_chunk = (current_chunk + " " + para).strip() if current_chunk else para
+        if buf_tokens + para_tokens <= max_tokens:
+            buf.append(para)
+            buf_tokens += para_tokens
         else:
-            if current_tokens >= min_tokens:
-                chunks.append(clean_text(current_chunk))
+            if buf_tokens >= min_tokens:
+                chunks.append(clean_text(" ".join(buf)))
             if para_tokens > max_tokens:
-                sentences = re.split(r'(?<=[।.!?])\s+', para)
-                temp_chunk = ""
+                sentences = _SENT_RE.split(para)
+                temp_buf = []
+                temp_tokens = 0
                 for sent in sentences:
                     sent_tokens = count_tokens(sent)
-                    if count_tokens(temp_chunk) + sent_tokens <= max_tokens:
-                        temp_chunk = (temp_chunk + " " + sent).strip() if temp_chunk else sent
+                    if temp_tokens + sent_tokens <= max_tokens:
+                        temp_buf.append(sent)
+                        temp_tokens += sent_tokens
                     else:
-                        if count_tokens(temp_chunk) >= min_tokens:
-                            chunks.append(clean_text(temp_chunk))
-                        temp_chunk = sent
-                if temp_chunk and count_tokens(temp_chunk) >= min_tokens:
-                    chunks.append(clean_text(temp_chunk))
-                current_chunk = ""
+                        if temp_tokens >= min_tokens:
+                            chunks.append(clean_text(" ".join(temp_buf)))
+                        temp_buf = [sent]
+                        temp_tokens = sent_tokens
+                if temp_buf and temp_tokens >= min_tokens:
+                    chunks.append(clean_text(" ".join(temp_buf)))
+                buf = []
+                buf_tokens = 0
             else:
-                current_chunk = para
+                buf = [para]
+                buf_tokens = para_tokens
 
-    if current_chunk and count_tokens(current_chunk) >= min_tokens:
-        chunks.append(clean_text(current_chunk))
+    if buf and buf_tokens >= min_tokens:
+        chunks.append(clean_text(" ".join(buf)))
 
     return chunks
 
 
 # ---------------- STORAGE ----------------
-def save_chunk_to_disk(output_dir: Path, pdf_path: Path, page_num: int, chunk_num: int, text: str):
-    """Save a single text chunk + metadata as JSON file."""
-    os.makedirs(output_dir, exist_ok=True)
-    chunk_id = f"page{page_num}_chunk{chunk_num}_{uuid.uuid4().hex[:6]}"
+class ChunkWriter:
+    """Append chunk records to a single chunks.jsonl file per PDF.
 
-    metadata = {
-        "id": chunk_id,
-        "page": page_num,
-        "chunk_num": chunk_num,
-        "word_count": len(text.split()),
-        "char_count": len(text),
-        "language_hint": detect_language_hint(text),
-        "source_file": str(pdf_path)
-    }
+    One open file handle and one line per chunk replaces the previous
+    one-pretty-printed-JSON-file-per-chunk layout, cutting per-chunk
+    open/close syscalls and indent-formatting cost.
+    """
+
+    def __init__(self, output_dir: Path):
+        os.makedirs(output_dir, exist_ok=True)
+        self.path = Path(output_dir) / "chunks.jsonl"
+        self._f = open(self.path, "wb")
+
+    def write(self, pdf_path: Path, page_num: int, chunk_num: int, text: str, language_hint: str = None):
+        chunk_id = f"page{page_num}_chunk{chunk_num}_{uuid.uuid4().hex[:6]}"
+
+        metadata = {
+            "id": chunk_id,
+            "page": page_num,
+            "chunk_num": chunk_num,
+            "word_count": len(text.split()),
+            "char_count": len(text),
+            "language_hint": language_hint if language_hint is not None else detect_language_hint(text),
+            "source_file": str(pdf_path)
+        }
 
-    out_path = output_dir / f"{chunk_id}.json"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump({"metadata": metadata, "text": text}, f, ensure_ascii=False, indent=2)
+        self._f.write(orjson.dumps({"metadata": metadata, "text": text}))
+        self._f.write(b"\n")
+        return chunk_id
 
-    return str(out_path)
+    def close(self):
+        self._f.close()
 
 
 # ---------------- MAIN PIPELINE ----------------
+def _limit_ocr_threads():
+    """Worker initializer: Tesseract spawns its own OpenMP threads per
+    call, and with pages already fanned out across processes that only
+    causes oversubscription. Scoped to the workers — set in the parent it
+    would also cap FAISS and torch OpenMP teams."""
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _page_is_imageheavy(page) -> bool:
+    """True when some image covers at least 30% of the page area."""
+    page_area = abs(page.rect)
+    if not page_area:
+        return False
+    for info in page.get_image_info():
+        if abs(fitz.Rect(info["bbox"])) > 0.3 * page_area:
+            return True
+    return False
+
+
+def _process_page(args):
+    """Extract/OCR and chunk one page. Runs inside a worker process.
+
+    Opens its own document handle (PyMuPDF docs are not fork-safe) and
+    returns (page_num, chunk_num, text, language_hint) tuples; the parent
+    process does all disk writes.
+    """
+    pdf_path, page_num = args
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc[page_num - 1]
+        # We only chunk the text, so skip the layout-preserving extraction
+        # mode.
+        text = page.get_text("text", flags=fitz.TEXT_DEHYPHENATE | fitz.TEXT_MEDIABOX_CLIP)
+
+        # OCR only pages that are both text-poor AND mostly covered by an
+        # image — a character-count check alone misfires on scanned pages
+        # with one stray text object.
+        if count_tokens(text) < 20 and _page_is_imageheavy(page):
+            # Render grayscale at 300 DPI: Tesseract binarizes internally
+            # anyway, so "L" mode carries a third of the bytes of RGB while
+            # the higher resolution improves recognition. The raw samples
+            # go to PIL directly — no PNG encode/decode round-trip.
+            pix = page.get_pixmap(dpi=300, colorspace=fitz.csGRAY)
+            img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+            text = pytesseract.image_to_string(img, lang=pick_langs(text))
+    finally:
+        doc.close()
+
+    chunks = multilingual_chunk(text)
+    langs = detect_languages_batch(chunks)
+    return [(page_num, chunk_num, chunk_text, lang)
+            for chunk_num, (chunk_text, lang) in enumerate(zip(chunks, langs), 1)]
+
+
 def process_pdf(pdf_path: str, output_base_dir: str = "data/chunks"):
     """
     Process a PDF:
     - Extract text from pages
     - Perform OCR if needed
-    - Chunk and save all chunks as JSON
-    Returns: (list_of_chunk_paths, chunk_output_dir)
+    - Chunk and append all chunks to one chunks.jsonl
+    Returns: (list_of_chunk_ids, chunk_output_dir)
     """
     pdf_path = Path(pdf_path)
     if not pdf_path.exists():
@@ -124,29 +273,33 @@ def process_pdf(pdf_path: str, output_base_dir: str = "data/chunks"):
     os.makedirs(output_dir, exist_ok=True)
 
     doc = fitz.open(pdf_path)
-    all_chunk_paths = []
-
-    for page_num, page in enumerate(doc, 1):
-        print(f"🔹 Processing page {page_num}/{len(doc)}...")
-        text = page.get_text("text")
+    num_pages = len(doc)
+    doc.close()
 
-        # fallback to OCR if text missing or too short
-        if len(text.strip()) < 10:
-            print(f"⚠️ Using OCR for page {page_num}")
-            pix = page.get_pixmap()
-            temp_img = output_dir / f"page_{page_num}.png"
-            pix.save(temp_img)
-            text = ocr_image_to_text(temp_img)
-            temp_img.unlink(missing_ok=True)
+    writer = ChunkWriter(output_dir)
+    write_futures = []
 
-        chunks = multilingual_chunk(text)
-
-        for chunk_num, chunk_text in enumerate(chunks, 1):
-            chunk_path = save_chunk_to_disk(output_dir, pdf_path, page_num, chunk_num, chunk_text)
-            all_chunk_paths.append(chunk_path)
-
-    print(f"✅ Completed: {len(all_chunk_paths)} chunks saved in {output_dir}")
-    return all_chunk_paths, str(output_dir)
+    # OCR dominates and is independent per page, so fan pages out across
+    # processes. Writes go through a single-worker thread pool: the write()
+    # syscall releases the GIL, so disk I/O overlaps OCR of later pages
+    # while one worker keeps the jsonl appends ordered.
+    page_args = [(str(pdf_path), i) for i in range(1, num_pages + 1)]
+    try:
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_limit_ocr_threads) as ex, \
+                ThreadPoolExecutor(max_workers=1) as io_pool:
+            for page_chunks in ex.map(_process_page, page_args):
+                if page_chunks:
+                    print(f"🔹 Processed page {page_chunks[0][0]}/{num_pages}...")
+                for page_num, chunk_num, chunk_text, lang in page_chunks:
+                    write_futures.append(
+                        io_pool.submit(writer.write, pdf_path, page_num, chunk_num, chunk_text, lang)
+                    )
+        all_chunk_ids = [fut.result() for fut in write_futures]
+    finally:
+        writer.close()
+
+    print(f"✅ Completed: {len(all_chunk_ids)} chunks saved in {output_dir}")
+    return all_chunk_ids, str(output_dir)
 
 
 # ---------------- RUNNER ----------------
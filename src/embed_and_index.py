@@ -1,9 +1,10 @@
 import os
 import json
+import orjson
 from pathlib import Path
 import faiss
 import numpy as np
-from tqdm import tqdm
+import torch
 from sentence_transformers import SentenceTransformer
 
 
@@ -15,39 +16,41 @@ DEFAULT_BATCH_SIZE = 64
 
 # ---------------- HELPER FUNCTIONS ----------------
 def load_chunk_texts(chunk_folder: Path):
-    """Load text and metadata from all chunk JSON files."""
+    """Load text and metadata for all chunks of a PDF.
+
+    Prefers the single chunks.jsonl written by ChunkWriter; falls back to
+    the legacy one-JSON-file-per-chunk layout.
+    """
+    jsonl_path = chunk_folder / "chunks.jsonl"
+    texts, metadata = [], []
+
+    if jsonl_path.exists():
+        with open(jsonl_path, "rb") as jf:
+            for line in jf:
+                rec = orjson.loads(line)
+                texts.append(rec["text"])
+                metadata.append(rec["metadata"])
+        return texts, metadata, [jsonl_path]
+
     chunk_files = list(chunk_folder.glob("*.json"))
     if not chunk_files:
         raise FileNotFoundError(f"No chunk files found in {chunk_folder}")
 
-    texts, metadata = [], []
     for f in chunk_files:
-        with open(f, "r", encoding="utf-8") as jf:
-            data = json.load(jf)
+        with open(f, "rb") as jf:
+            data = orjson.loads(jf.read())
             texts.append(data["text"])
             metadata.append(data["metadata"])
     return texts, metadata, chunk_files
 
 
-def train_ivf_index(model, texts, dim, n_list):
-    """Train an IVF index on a representative sample of embeddings."""
-    print("🧠 Training IVF index...")
-    sample_texts = texts[:min(1000, len(texts))]
-    sample_embeddings = np.array(model.encode(sample_texts, show_progress_bar=True)).astype("float32")
-
-    quantizer = faiss.IndexFlatL2(dim)
-    index = faiss.IndexIVFFlat(quantizer, dim, n_list, faiss.METRIC_L2)
-    index.train(sample_embeddings)
-    print("✅ IVF index trained.")
-    return index
-
-
 # ---------------- MAIN FUNCTION ----------------
 def embed_chunks(
     chunk_folder: str,
     model_name: str = DEFAULT_EMBEDDING_MODEL,
     faiss_dir: str = DEFAULT_FAISS_DIR,
     batch_size: int = DEFAULT_BATCH_SIZE,
+    model: SentenceTransformer = None,
 ):
     """
     Dynamically embeds all chunk JSONs in `chunk_folder` using a multilingual model,
@@ -57,6 +60,7 @@ def embed_chunks(
         total_chunks (int)
         faiss_index_path (str)
         metadata_path (str)
+        embeddings_path (str)  # fp16 memmap, shape (total_chunks, dim)
     """
     chunk_folder = Path(chunk_folder)
     if not chunk_folder.exists():
@@ -64,36 +68,96 @@ def embed_chunks(
 
     os.makedirs(faiss_dir, exist_ok=True)
 
+    # FAISS defaults to every core; leave half for the embedding model when
+    # it also runs on CPU.
+    faiss.omp_set_num_threads(max(1, os.cpu_count() // 2))
+
     # Construct output paths dynamically
     index_name = f"{chunk_folder.stem}_multilang_index_ivf.faiss"
     metadata_name = f"{chunk_folder.stem}_multilang_metadata.json"
+    embeddings_name = f"{chunk_folder.stem}_multilang_embeddings_fp16.dat"
     faiss_index_path = Path(faiss_dir) / index_name
     metadata_path = Path(faiss_dir) / metadata_name
+    embeddings_path = Path(faiss_dir) / embeddings_name
 
-    # Load model
-    print(f"🚀 Loading embedding model: {model_name}")
-    model = SentenceTransformer(model_name)
+    # Load model unless the caller passed a shared one (re-loading costs
+    # several seconds per PDF)
+    if model is None:
+        print(f"🚀 Loading embedding model: {model_name}")
+        model = SentenceTransformer(model_name)
+        if torch.cuda.is_available():
+            model.half()  # fp16 doubles encode throughput on GPU
 
     # Load chunk texts
     texts, metadata_list, chunk_files = load_chunk_texts(chunk_folder)
     print(f"📄 Found {len(texts)} chunks to embed.")
 
-    # Setup index
-    dummy_vec = model.encode(["test"], show_progress_bar=False)
-    dim = len(dummy_vec[0])
-    n_list = min(1000, len(texts))
-
-    # Train index
-    index = train_ivf_index(model, texts, dim, n_list)
-
-    # Stream embeddings
-    for i in tqdm(range(0, len(texts), batch_size), desc="🔹 Embedding batches"):
-        batch_texts = texts[i:i + batch_size]
-        embeddings = model.encode(batch_texts, show_progress_bar=False)
-        embeddings = np.array(embeddings).astype("float32")
+    # SBERT exposes the output dimension directly — no need to run a dummy
+    # forward pass just to measure it
+    dim = model.get_sentence_embedding_dimension()
+
+    if torch.cuda.device_count() > 1:
+        # Spread encoding over every GPU; a plain encode() call leaves all
+        # devices but one idle.
+        pool = model.start_multi_process_pool()
+        try:
+            embeddings = model.encode_multi_process(texts, pool, batch_size=batch_size)
+        finally:
+            model.stop_multi_process_pool(pool)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        # encode_multi_process doesn't normalize; match the single-device path
+        faiss.normalize_L2(embeddings)
+    else:
+        # Encode everything in one call — SentenceTransformer handles
+        # batching, length-sorting and fp16 internally, which a manual
+        # Python loop loses.
+        embeddings = model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=True,
+        )
+        # SBERT already returns contiguous float32; this is a no-op then,
+        # and a single up-front copy otherwise (e.g. fp16 models).
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    if len(texts) < 2000:
+        # Tiny corpora: IVF training dominates runtime and the resulting
+        # clusters are too small to help recall. A graph index needs no
+        # training pass at all.
+        print("🧠 Building HNSW index (no training needed)...")
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 80
+        index.add(embeddings)
+    else:
+        # Train the IVF on a slice of the matrix we are about to add instead
+        # of re-encoding the leading texts a second time. PQ compresses each
+        # vector to dim/8 bytes but needs plenty of training vectors; mid-size
+        # corpora get fp16 scalar quantization instead (half the bytes of
+        # Flat, decoded with SIMD during search, negligible recall loss for
+        # MiniLM-class vectors).
+        n_list = min(1000, max(1, int(4 * len(texts) ** 0.5)))
+        use_pq = len(texts) >= 4096
+        factory = f"IVF{n_list},PQ{dim // 8}x8" if use_pq else f"IVF{n_list},SQfp16"
+        index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+
+        print(f"🧠 Training IVF index ({factory})...")
+        index.train(embeddings[:max(40 * n_list, min(len(embeddings), 100_000))])
+        print("✅ IVF index trained.")
         index.add(embeddings)
 
-    # Save FAISS index
+    # Persist a compact fp16 copy for downstream consumers (rerankers etc.)
+    # and drop the in-memory matrix — the index owns the searchable copy.
+    # Readers: np.memmap(path, dtype="float16", mode="r", shape=(N, dim))
+    mm = np.memmap(embeddings_path, dtype="float16", mode="w+", shape=embeddings.shape)
+    mm[:] = embeddings.astype(np.float16)
+    mm.flush()
+    del mm
+    del embeddings
+
+    # Save FAISS index (IVF-family, so readers can load it with
+    # IO_FLAG_MMAP instead of pulling it fully into RAM)
     faiss.write_index(index, str(faiss_index_path))
     print(f"✅ FAISS index saved to: {faiss_index_path}")
 
@@ -103,17 +167,18 @@ def embed_chunks(
     print(f"✅ Metadata saved to: {metadata_path}")
 
     print(f"\n✅ Successfully embedded {len(texts)} chunks.")
-    return len(texts), str(faiss_index_path), str(metadata_path)
+    return len(texts), str(faiss_index_path), str(metadata_path), str(embeddings_path)
 
 
 # ---------------- PIPELINE COMPATIBLE ENTRY ----------------
 if __name__ == "__main__":
     chunk_dir = input("📁 Enter chunk folder path: ").strip()
     try:
-        total, index_path, meta_path = embed_chunks(chunk_dir)
+        total, index_path, meta_path, emb_path = embed_chunks(chunk_dir)
         print(f"\n✅ Embedding complete!")
         print(f"Total chunks: {total}")
         print(f"FAISS Index: {index_path}")
         print(f"Metadata: {meta_path}")
+        print(f"Embeddings (fp16): {emb_path}")
     except Exception as e:
         print(f"❌ Error during embedding: {e}")
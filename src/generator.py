@@ -1,12 +1,16 @@
 # generator.py
+import hashlib
+import io
 import os
 import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from retriever import Retriever
 from reranker import Reranker
 from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.schema import AIMessage, HumanMessage
 from dotenv import load_dotenv
 import os
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -22,6 +26,9 @@ if not GOOGLE_API_KEY:
 os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
 
 DB_PATH = "chat_history.db"
+HISTORY_WINDOW = 50  # newest chat turns loaded into memory (prompt budget)
+CONTEXT_TOKEN_BUDGET = 3000  # tokens of retrieved context per prompt
+ANSWER_CACHE_SIZE = 256
 #GROQ_API_KEY = os.environ.get("GROQ_API_KEY", None)
 
 
@@ -40,7 +47,12 @@ class Generator:
         temperature=0.3,
         max_output_tokens=512,
         )
-        self.memory = ConversationBufferMemory(
+        # Summarized history under a fixed token budget: the prompt prefix
+        # stays stable across turns (so Gemini's implicit prompt cache can
+        # hit) and long sessions stop inflating every request.
+        self.memory = ConversationSummaryBufferMemory(
+            llm=self.llm,
+            max_token_limit=1000,
             memory_key="chat_history",
             input_key="query",
             return_messages=True
@@ -49,6 +61,17 @@ class Generator:
         # ----------------------------
         # DB setup & load previous history
         # ----------------------------
+        # One long-lived autocommit connection: WAL + relaxed sync keeps the
+        # page cache hot between chat turns instead of paying connect/close
+        # on every call.
+        self._conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA cache_size=-20000;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+        """)
         self._init_db()
         self._load_history()
 
@@ -60,80 +83,130 @@ class Generator:
             self.reranker = Reranker()
 
         # ----------------------------
-        # LangChain Prompt & Chain
+        # LangChain Prompt
         # ----------------------------
-        self.chain = self._init_chain()
+        self.prompt = self._init_prompt()
+
+        # Exact-match answer cache keyed by (normalized query, hash of the
+        # retrieved context): a repeated question over the same chunks skips
+        # rerank and the LLM call entirely.
+        self._answer_cache = OrderedDict()
+
+        # Chat rows are written off the response path; one worker keeps
+        # them in order.
+        self._db_pool = ThreadPoolExecutor(max_workers=1)
 
     # ----------------------------
     # Database functions
     # ----------------------------
     def _init_db(self):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
+        self._conn.execute("""
             CREATE TABLE IF NOT EXISTS chat_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_message TEXT,
                 bot_response TEXT
             )
         """)
-        conn.commit()
-        conn.close()
 
     def _load_history(self):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_message, bot_response FROM chat_history")
-        rows = cursor.fetchall()
-        conn.close()
+        # Only the newest turns: an unbounded history bloats every prompt
+        # sent to the LLM. Iterate the cursor directly (no fetchall
+        # materialization) and append the messages in one extend instead of
+        # per-message add_* calls.
+        cursor = self._conn.execute(
+            "SELECT user_message, bot_response FROM chat_history ORDER BY id DESC LIMIT ?",
+            (HISTORY_WINDOW,),
+        )
+        rows = [row for row in cursor]
+        rows.reverse()  # back to chronological order
+        messages = []
         for user_msg, bot_msg in rows:
-            self.memory.chat_memory.add_user_message(user_msg)
-            self.memory.chat_memory.add_ai_message(bot_msg)
+            messages.append(HumanMessage(content=user_msg))
+            messages.append(AIMessage(content=bot_msg))
+        self.memory.chat_memory.messages.extend(messages)
+        # Summary-buffer memory only prunes on save_context; without this
+        # the first prompt after a restart carries all loaded turns raw,
+        # blowing the 1000-token budget and the stable prompt prefix.
+        self.memory.prune()
 
     def _save_chat(self, user_message: str, bot_response: str):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
+        self._conn.execute(
             "INSERT INTO chat_history (user_message, bot_response) VALUES (?, ?)",
             (user_message, bot_response)
         )
-        conn.commit()
-        conn.close()
+
+    def close(self):
+        self._db_pool.shutdown(wait=True)
+        self._conn.close()
+
+    def __del__(self):
+        # Drain the writer pool before the connection goes away — a
+        # _save_chat submitted just before garbage collection would
+        # otherwise run against a closed connection and be lost.
+        try:
+            self.close()
+        except Exception:
+            pass
 
     # ----------------------------
-    # Prompt & Chain
+    # Prompt
     # ----------------------------
-    def _init_chain(self):
+    def _init_prompt(self):
+        # Static instruction first, slow-changing summarized history next,
+        # and the per-turn retrieval context + query last — everything up to
+        # {context} is then a stable prefix the provider can cache.
         prompt_template = ChatPromptTemplate.from_template("""
-        You are a multilingual expert assistant. Use the following context and prior chat history 
-        to answer the user's question accurately and concisely.
-
-        Context:
-        {context}
+        You are a multilingual expert assistant. Use the prior chat history and the
+        following context to answer the user's question accurately and concisely.
 
         Chat History:
         {chat_history}
 
+        Context:
+        {context}
+
         User Question: {query}
 
         Answer:
         """)
-        return LLMChain(
-            llm=self.llm,
-            prompt=prompt_template,
-            memory=self.memory
-        )
+        return prompt_template
 
     # ----------------------------
     # Generate answer
     # ----------------------------
-    def generate_answer(self, query: str, retriever_results: list):
+    @staticmethod
+    def _cache_key(query: str, retriever_results: list):
+        h = hashlib.blake2b(digest_size=16)
+        for r in retriever_results:
+            h.update(r["text"].encode("utf-8"))
+        return (query.strip().lower(), h.digest())
+
+    @staticmethod
+    def _count_tokens(text: str) -> int:
+        # Local heuristic only — llm.get_num_tokens is a remote
+        # countTokens API call in langchain-google-genai, which would add
+        # a network round trip per chunk while assembling context.
+        return max(1, len(text) // 4)  # ~4 chars per token
+
+    def stream_answer(self, query: str, retriever_results: list):
         """
-        Generate answer from query and retrieved results.
+        Yield the answer incrementally as the LLM produces it.
         retriever_results: list of dicts from Retriever.hybrid_search
         """
         if not retriever_results:
-            return "⚠ No relevant context found for this query."
+            yield "⚠ No relevant context found for this query."
+            return
+
+        cache_key = self._cache_key(query, retriever_results)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            self._answer_cache.move_to_end(cache_key)
+            # The cache only skips the LLM call — the user still saw this
+            # exchange, so memory and the DB must record it like any other.
+            self.memory.save_context({"query": query}, {"output": cached})
+            self._db_pool.submit(self._save_chat, query, cached)
+            yield cached
+            return
 
         # ----------------------------
         # Optional Reranker
@@ -142,21 +215,58 @@ class Generator:
         if self.use_reranker and hasattr(self.reranker, "rerank_results"):
             context_results = self.reranker.rerank_results(query, retriever_results)
 
-        # Join top N chunks into context
-        context = "\n\n".join([r["text"] for r in context_results[:5]])
+        # Join the top chunks into context under a token budget. Truncation
+        # happens here, after reranking — the retriever used to cap chunks
+        # at 500 chars before the reranker even saw them.
+        buf = io.StringIO()
+        budget = CONTEXT_TOKEN_BUDGET
+        for r in context_results[:5]:
+            text = r["text"]
+            tokens = self._count_tokens(text)
+            if tokens > budget:
+                text = text[: max(0, int(len(text) * budget / tokens))]
+                if text:
+                    if buf.tell():
+                        buf.write("\n\n")
+                    buf.write(text)
+                break
+            if buf.tell():
+                buf.write("\n\n")
+            buf.write(text)
+            budget -= tokens
+        context = buf.getvalue()
 
         if not context.strip():
-            return "⚠ No relevant context found for this query."
+            yield "⚠ No relevant context found for this query."
+            return
+
+        # Stream from the LLM directly — LLMChain.invoke blocked until the
+        # whole completion arrived; here the first tokens reach the caller
+        # as soon as the model emits them.
+        chat_history = self.memory.load_memory_variables({"query": query}).get(
+            "chat_history", ""
+        )
+        messages = self.prompt.format_messages(
+            context=context, chat_history=chat_history, query=query
+        )
+        parts = []
+        for chunk in self.llm.stream(messages):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        bot_response = "".join(parts)
 
-        # Invoke LangChain
-        result = self.chain.invoke({"context": context, "query": query})
+        self.memory.save_context({"query": query}, {"output": bot_response})
+        # Save to DB off the response path
+        self._db_pool.submit(self._save_chat, query, bot_response)
 
-        # Safe extraction of response text
-        if isinstance(result, dict):
-            bot_response = result.get("text") or result.get("output_text", "")
-        else:
-            bot_response = str(result)
+        self._answer_cache[cache_key] = bot_response
+        if len(self._answer_cache) > ANSWER_CACHE_SIZE:
+            self._answer_cache.popitem(last=False)
 
-        # Save to DB
-        self._save_chat(query, bot_response)
-        return bot_response
+    def generate_answer(self, query: str, retriever_results: list):
+        """
+        Generate answer from query and retrieved results.
+        retriever_results: list of dicts from Retriever.hybrid_search
+        """
+        return "".join(self.stream_answer(query, retriever_results))
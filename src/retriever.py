@@ -1,13 +1,28 @@
 
 import faiss
-import json
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import orjson
+import torch
 from sentence_transformers import SentenceTransformer
 from rank_bm25 import BM25Okapi
+
+try:
+    import bm25s  # optional: SciPy-sparse BM25, vectorized scoring
+except ImportError:
+    bm25s = None
 import re
 import unicodedata
 from pathlib import Path
 
+_TOK_RE = re.compile(r'\w+', re.UNICODE)
+
+# torch otherwise spawns one intra-op thread per core, which hurts small
+# single-query encodes on many-core CPUs
+torch.set_num_threads(min(8, os.cpu_count() or 1))
+
 class Retriever:
     def __init__(
         self,
@@ -17,7 +32,8 @@ class Retriever:
         embedding_model_name: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
         semantic_weight: float = 0.6,
         keyword_weight: float = 0.4,
-        top_k: int = 10
+        top_k: int = 10,
+        use_mmap: bool = True
     ):
         self.chunk_folder = Path(chunk_folder)
         self.faiss_index_path = faiss_index_path
@@ -30,72 +46,158 @@ class Retriever:
         # Load model
         self.model = SentenceTransformer(self.embedding_model_name)
 
-        # Load FAISS index
-        self.index = faiss.read_index(self.faiss_index_path)
+        # Load FAISS index. IVF-family indexes can be memory-mapped, so a
+        # Retriever per PDF only pages in the lists it actually searches
+        # instead of pulling the whole file into RAM. Other families (e.g.
+        # the HNSW index built for small corpora) don't support mmap, so
+        # fall back to a normal read.
+        if use_mmap:
+            try:
+                self.index = faiss.read_index(
+                    self.faiss_index_path,
+                    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                )
+            except RuntimeError:
+                self.index = faiss.read_index(self.faiss_index_path)
+        else:
+            self.index = faiss.read_index(self.faiss_index_path)
+
+        # Search-time knobs for the index families the build step emits
+        try:
+            ivf = faiss.extract_index_ivf(self.index)
+            ivf.nprobe = 16
+        except RuntimeError:
+            if hasattr(self.index, "hnsw"):
+                self.index.hnsw.efSearch = 64
 
         # Load metadata
-        with open(self.metadata_path, "r", encoding="utf-8") as f:
-            self.metadata = json.load(f)
+        with open(self.metadata_path, "rb") as f:
+            self.metadata = orjson.loads(f.read())
+
+        # Load texts for BM25 (chunks.jsonl when present, else legacy
+        # per-chunk JSON files)
+        texts = []
+        jsonl_path = self.chunk_folder / "chunks.jsonl"
+        if jsonl_path.exists():
+            with open(jsonl_path, "rb") as jf:
+                for line in jf:
+                    text = orjson.loads(line).get("text", "").strip()
+                    if text:
+                        texts.append(text)
+        else:
+            # Hundreds of small files read sequentially is latency-bound;
+            # the GIL is released during open/read, so a thread pool
+            # overlaps the syscalls. map() keeps the file order stable.
+            chunk_files = list(self.chunk_folder.glob("*.json"))
 
-        # Load texts for BM25
-        chunk_files = list(self.chunk_folder.glob("*.json"))
+            def _load(p):
+                with open(p, "rb") as jf:
+                    return orjson.loads(jf.read()).get("text", "").strip()
+
+            with ThreadPoolExecutor(max_workers=16) as ex:
+                texts = [t for t in ex.map(_load, chunk_files) if t]
+
+        # Tokenize each text exactly once (the old comprehension ran
+        # _clean_and_tokenize twice per chunk) and keep texts aligned with
+        # the BM25 corpus.
+        tokenized_corpus = []
         self.texts = []
-        for f in chunk_files:
-            with open(f, "r", encoding="utf-8") as jf:
-                data = json.load(jf)
-                text = data.get("text", "").strip()
-                if text:
-                    self.texts.append(text)
-
-        tokenized_corpus = [self._clean_and_tokenize(t) for t in self.texts if len(self._clean_and_tokenize(t)) > 0]
+        for text in texts:
+            toks = self._clean_and_tokenize(text)
+            if toks:
+                tokenized_corpus.append(toks)
+                self.texts.append(text)
         if not tokenized_corpus:
             raise ValueError("No valid text found to build BM25.")
-        self.bm25 = BM25Okapi(tokenized_corpus)
+        # BM25Okapi scores with a pure-Python loop over documents per query
+        # term; bm25s does the same math as a sparse-matrix product, so
+        # prefer it when installed.
+        if bm25s is not None:
+            self.bm25 = bm25s.BM25()
+            self.bm25.index(tokenized_corpus)
+        else:
+            self.bm25 = BM25Okapi(tokenized_corpus)
+
+        # Chat queries repeat (and follow-ups re-use the same wording), so
+        # memoize the model encode and BM25 tokenization per normalized
+        # query string. Per-instance caches — lru_cache on a method would
+        # pin the Retriever alive.
+        self._encode_query_cached = functools.lru_cache(maxsize=512)(self._encode_query)
+        self._tokenize_query_cached = functools.lru_cache(maxsize=512)(
+            lambda q: tuple(self._clean_and_tokenize(q))
+        )
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        return unicodedata.normalize("NFKC", query).strip().lower()
+
+    def _encode_query(self, norm_query: str) -> bytes:
+        # Packed bytes keep the cached value hashable and immutable.
+        # Normalized, to match the inner-product index the build step writes.
+        vec = self.model.encode(
+            [norm_query], convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+        return np.ascontiguousarray(vec).tobytes()
 
     def _clean_and_tokenize(self, text):
-        text = unicodedata.normalize("NFKC", text)
-        tokens = re.findall(r'\w+', text.lower(), flags=re.UNICODE)
-        return tokens
+        return _TOK_RE.findall(unicodedata.normalize("NFKC", text).lower())
 
     def hybrid_search(self, query: str, top_k: int = None):
         if top_k is None:
             top_k = self.top_k
 
+        norm_query = self._normalize_query(query)
+
         # Semantic search
-        query_vec = np.array(self.model.encode([query])).astype("float32")
-        semantic_dists, semantic_indices = self.index.search(query_vec, top_k)
-        semantic_scores = {}
-        for dist, idx in zip(semantic_dists[0], semantic_indices[0]):
-            if idx == -1 or idx >= len(self.metadata):
-                continue
-            semantic_scores[idx] = 1 / (1 + dist)
-
-        # Keyword search
-        tokenized_query = self._clean_and_tokenize(query)
-        keyword_scores = self.bm25.get_scores(tokenized_query)
-        top_keyword_indices = np.argsort(keyword_scores)[::-1][:top_k]
-        keyword_scores_dict = {int(i): float(keyword_scores[i]) for i in top_keyword_indices}
-
-        # Combine
-        combined_scores = {}
-        all_indices = set(semantic_scores.keys()) | set(keyword_scores_dict.keys())
-        for idx in all_indices:
-            sem = semantic_scores.get(idx, 0)
-            key = keyword_scores_dict.get(idx, 0)
-            combined = self.semantic_weight * sem + self.keyword_weight * key
-            combined_scores[idx] = combined
-
-        # Sort
-        sorted_results = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+        query_vec = np.frombuffer(
+            self._encode_query_cached(norm_query), dtype=np.float32
+        ).reshape(1, -1)
+        semantic_sims, semantic_indices = self.index.search(query_vec, top_k)
+
+        # Keyword search. A punctuation-only query tokenizes to nothing,
+        # which bm25s rejects (BM25Okapi returned zeros) — score it as
+        # all-zeros so ranking falls through to the semantic side.
+        tokenized_query = list(self._tokenize_query_cached(norm_query))
+        if tokenized_query:
+            keyword_scores = self.bm25.get_scores(tokenized_query)
+        else:
+            keyword_scores = np.zeros(len(self.texts), dtype=np.float32)
+
+        # Fuse scores as one vectorized FMA over preallocated arrays instead
+        # of a Python set-union/dict merge plus an O(N log N) sort.
+        n = len(self.metadata)
+        sem = np.zeros(n, dtype=np.float32)
+        idxs = semantic_indices[0]
+        valid = (idxs >= 0) & (idxs < n)
+        # The index is inner-product over normalized vectors, so the search
+        # output is already a cosine similarity — use it as the score
+        # directly instead of the old 1/(1+L2) transform.
+        sem[idxs[valid]] = semantic_sims[0][valid]
+
+        key = np.zeros(n, dtype=np.float32)
+        kw = np.asarray(keyword_scores, dtype=np.float32)[:n]
+        key[:len(kw)] = kw
+
+        combined = self.semantic_weight * sem + self.keyword_weight * key
+
+        # Top-k selection: O(N) partition, then sort just the k survivors
+        k = min(top_k, n)
+        top = np.argpartition(-combined, k - 1)[:k]
+        top = top[np.argsort(-combined[top])]
+
         results = []
-        for rank, (idx, score) in enumerate(sorted_results, start=1):
+        for rank, idx in enumerate(top, start=1):
+            idx = int(idx)
             m = self.metadata[idx] if idx < len(self.metadata) else {}
             text = self.texts[idx] if idx < len(self.texts) else ""
             results.append({
                 "rank": rank,
-                "score": round(float(score), 4),
+                "score": round(float(combined[idx]), 4),
                 "language": m.get("language_hint", "unknown"),
                 "source_file": m.get("source_file", "unknown"),
-                "text": text[:500]
+                # Full text — truncation is the generator's job, after
+                # reranking; cutting here starved both stages of context
+                "text": text,
+                "preview": text[:500]
             })
         return results
@@ -23,10 +23,11 @@ except FileNotFoundError:
 # -------------------------
 print("🔹 Embedding chunks and building FAISS index...")
 try:
-    total_chunks, faiss_index_path, metadata_path = embed_chunks(chunk_dir)
+    total_chunks, faiss_index_path, metadata_path, embeddings_path = embed_chunks(chunk_dir)
     print(f"✅ Embedded {total_chunks} chunks")
     print(f"FAISS index saved at: {faiss_index_path}")
     print(f"Metadata saved at: {metadata_path}")
+    print(f"Embeddings (fp16) saved at: {embeddings_path}")
 except Exception as e:
     print(f"❌ Error during embedding: {e}")
     exit(1)
@@ -1,12 +1,14 @@
-import json
+import orjson
 
 def write_jsonl(path, records):
- with open(path, "w", encoding="utf-8") as f:
+ # orjson emits bytes directly; one big write buffer keeps the syscall
+ # count low on the embedding pipeline's sustained IO path.
+ with open(path, "wb", buffering=1 << 20) as f:
   for r in records:
-   f.write(json.dumps(r, ensure_ascii=False) + "\n")
+   f.write(orjson.dumps(r) + b"\n")
 
 
 def read_jsonl(path):
- with open(path, "r", encoding="utf-8") as f:
+ with open(path, "rb", buffering=1 << 20) as f:
   for line in f:
-   yield json.loads(line)
\ No newline at end of file
+   yield orjson.loads(line)
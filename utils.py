@@ -5,12 +5,11 @@ from pathlib import Path
 
 
 def ensure_dirs():
- Path("datas/original_pdf").mkdir(parents=True, exist_ok=True)
- Path("datas/chunks").mkdir(parents=True, exist_ok=True)
- Path("datas/embeddings").mkdir(parents=True, exist_ok=True)
+ for p in ("datas/original_pdf", "datas/chunks", "datas/embeddings"):
+  Path(p).mkdir(parents=True, exist_ok=True)
 
 
 
 
 if __name__ == "__main__":
- ensure_dirs()
\ No newline at end of file
+ ensure_dirs()